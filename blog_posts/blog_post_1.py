@@ -18,24 +18,24 @@ from shared_types import *
 
 
 def plot_table(model: models.PointsModel) -> None:
-    cells = list()
-    for team in ALL_TEAMS:
-        new_row = list()
-        for opp in ALL_TEAMS:
-            if opp == team:
-                new_row.append(np.nan)
-            else:
-                game = Game(home=team, away=opp)
-                new_row.append(model.predict(game)[0])
-        cells.append(new_row)
+    # Rows are the home team, columns are the away team.
+    n = N_TEAMS
+    home_idx, away_idx = np.meshgrid(np.arange(n), np.arange(n), indexing="ij")
+    off_diag = home_idx != away_idx
+    games = [Game(home=ALL_TEAMS[home], away=ALL_TEAMS[away])
+             for home, away in zip(home_idx[off_diag], away_idx[off_diag])]
+    preds = model.predict_batch(games)
+
+    cells = np.full((n, n), np.nan)
+    cells[off_diag] = preds[:, 0]
 
     sns.heatmap(cells, xticklabels=ALL_TEAMS, yticklabels=ALL_TEAMS)
 
 # Graph for Interaction model
 data_18 = game_data.make_dataset(Season(2018))
+game_data.prewarm(data_18.games)
 logging.debug(str(data_18))
 
-model = models.InteractionModel()
 for model in [
     models.InteractionModel(),
     models.OffenseDefenseModel(),
@@ -46,4 +46,6 @@ for model in [
     logging.info(model)
     model.fit(data_18)
     logging.info(model.score(data_18))
-    # plot_table(model1)
+    # plot_table(model)
+
+logging.debug(game_data.load_game_data.cache_info())
@@ -1,4 +1,5 @@
 import logging
+from typing import Tuple
 
 logging.basicConfig(
     format="%(asctime)s  %(levelname)s:\t%(module)s::%(funcName)s:%(lineno)d\t-\t%(message)s",
@@ -6,18 +7,19 @@ logging.basicConfig(
 )
 
 import numpy as np
-import pandas as pd
 import seaborn as sns
-import statsmodels.api as sm
+from sklearn.linear_model import LogisticRegression
 
 sns.set_theme()
 
+from constants import *
 import game_data
 import models
 from shared_types import *
 
 # Graph for Interaction model
 data_18 = game_data.make_dataset(Season(2018))
+game_data.prewarm(data_18.games)
 
 
 # Shots on goal model
@@ -85,6 +87,10 @@ class ShotsWithGoalPerc(models.PointsModel):
 
         return (away_att * away_perc, home_att * home_perc)
 
+    def predict_batch(self, games: List[Game]) -> np.ndarray:
+        return (self._shot_model.predict_batch(games) *
+                self._goal_perc_model.predict_batch(games))
+
 
 logging.info("ShotsWithGoalPerc Model")
 shots_w_gp = ShotsWithGoalPerc()
@@ -101,53 +107,52 @@ rando = models.RandomModel()
 rando.fit(data_18)
 
 
+def decided_games(games: List[Game]) -> Tuple[List[Game], np.ndarray]:
+    """Drops ties, returning the remaining games and whether the away team won
+    each."""
+    # We skip Golden Knights so that code can run the same for all years
+    games = [game for game in games
+             if game.home in TEAM_INDEX and game.away in TEAM_INDEX]
+    data = [game_data.load_game_data(game) for game in games]
+    away_scores = np.fromiter((d.away_score for d in data), dtype=np.int16,
+                              count=len(data))
+    home_scores = np.fromiter((d.home_score for d in data), dtype=np.int16,
+                              count=len(data))
+    # Tie.  Should never happen?
+    decided = away_scores != home_scores
+    return ([game for game, keep in zip(games, decided) if keep],
+            (away_scores > home_scores)[decided])
+
+
+# Load these once, rather than once per model.
+train_games, train_away_won = decided_games(data_18.train)
+test_games, test_away_won = decided_games(data_18.test)
+
 for model in (rando, benchmark, shots_w_gp):
     logging.info("===================")
     logging.info(model)
 
-    score_diff, away_won, neg_home_ad = list(), list(), list()
-    for game in data_18.train:
-        data = game_data.load_game_data(game)
-        if data.away_score == data.home_score:
-            # Tie.  Should never happen?
-            continue
-
-        pred_away, pred_home = model.predict(game)
-        score_diff.append(pred_away - pred_home)
-        away_won.append(data.away_score > data.home_score)  # Actual
-        neg_home_ad.append(1)
-    df = pd.DataFrame({"away_won": away_won, "score_diff": score_diff,
-                       "neg_home_ad": neg_home_ad})
-    log_reg_ = sm.Logit(df["away_won"], df[["score_diff", "neg_home_ad"]])
-    log_reg = log_reg_.fit()
-    # logging.info(results.summary())
+    train_preds = model.predict_batch(train_games)
+    score_diff = train_preds[:, 0] - train_preds[:, 1]
+    neg_home_ad = np.ones_like(score_diff)
+    log_reg = LogisticRegression(C=np.inf, fit_intercept=False).fit(
+        np.column_stack([score_diff, neg_home_ad]),
+        train_away_won.astype(int))
 
     logging.info("")
 
+    # String the two predictions together
+    test_preds = model.predict_batch(test_games)
+    score_diff_test = test_preds[:, 0] - test_preds[:, 1]
+    pred = log_reg.predict_proba(
+        np.column_stack([score_diff_test, np.ones_like(score_diff_test)]))[:, 1]
+    act = test_away_won
+
     # Calculate the win percentage - how often the model is right.
-    win_num, win_den = 0, 0
+    win_den = len(act)
+    win_num = np.count_nonzero(((pred > 0.5) & act) | ((pred < 0.5) & ~act))
     # Calculate the log-likelihood.
-    log_likelihood = 0.0
-
-    for game in data_18.test:
-        # String the two predictions together
-        data = game_data.load_game_data(game)
-        if data.away_score == data.home_score:
-            # Tie.  Should never happen?
-            continue
-
-        pred_away, pred_home = model.predict(game)
-        pred = log_reg.predict([pred_away - pred_home, 1])[0]
-        act = data.away_score > data.home_score
-
-        win_den += 1
-        if (pred > 0.5 and act) or (pred < 0.5 and not act):
-            win_num += 1
-
-        if act:
-            log_likelihood += np.log(pred)
-        else:
-            log_likelihood += np.log(1 - pred)
+    log_likelihood = np.where(act, np.log(pred), np.log1p(-pred)).sum()
 
     logging.info("# pts")
     logging.info(win_den)
@@ -1,6 +1,9 @@
 """Some constants that will be shared potentially across files."""
 
 import os
+from typing import Dict, Tuple
+
+__all__ = ["ALL_TEAMS", "TEAM_INDEX", "N_TEAMS", "DATA_DIR", "LOGGING_DIR"]
 
 # If downloading, you need to set this directory to equal the directory that
 #  houses this file.
@@ -9,7 +12,7 @@ from computer_constants import TOP_LEVEL_DIR
 # An allowlist of teams.  Should match to https://www.cbssports.com/nhl/teams/
 #  short names in URLs.  We exclude Golden Knights in order to have
 #  apples-to-apples comparison with earlier seasons.
-ALL_TEAMS = [
+ALL_TEAMS: Tuple[str, ...] = (
     "CAR",
     "CHI",
     "CLB",
@@ -41,7 +44,10 @@ ALL_TEAMS = [
     "SJ",
     "STL",
     "LV",
-]
+)
+# Position of each team in ALL_TEAMS, for indexing per-team arrays.
+TEAM_INDEX: Dict[str, int] = {team: i for i, team in enumerate(ALL_TEAMS)}
+N_TEAMS = len(ALL_TEAMS)
 
 DATA_DIR = os.path.join(TOP_LEVEL_DIR, "data")
 LOGGING_DIR = os.path.join(TOP_LEVEL_DIR, "logging")
@@ -0,0 +1,64 @@
+"""Numba-compiled kernels for the innermost loops over games and plays.
+
+These are compiled eagerly at import, since each has an explicit signature, and
+cache=True saves the machine code under __pycache__.  So only the first import
+after a change pays the compile, and later runs load from disk.
+"""
+
+import numba as nb
+import numpy as np
+
+# Must match Play.Type values and GameData.teams values in shared_types.
+GOAL, SHOT = 2, 4
+AWAY, HOME, NO_TEAM = 0, 1, 2
+
+
+@nb.njit(nb.types.UniTuple(nb.int64, 4)(nb.uint8[:], nb.uint8[:]),
+         cache=True, nogil=True)
+def compute_stats(types, teams):
+    """Returns away_att, home_att, away_score, home_score for the columns of a
+    GameData."""
+    away_att, home_att, away_score, home_score = 0, 0, 0, 0
+    for i in range(types.size):
+        if types[i] == GOAL:
+            if teams[i] == AWAY:
+                away_att += 1
+                away_score += 1
+            elif teams[i] == HOME:
+                home_att += 1
+                home_score += 1
+        elif types[i] == SHOT:
+            if teams[i] == AWAY:
+                away_att += 1
+            elif teams[i] == HOME:
+                home_att += 1
+    return away_att, home_att, away_score, home_score
+
+
+@nb.njit(nb.types.Tuple((nb.float64[:], nb.int64[:]))(
+    nb.uint8[:], nb.uint8[:], nb.float64[:], nb.float64[:], nb.int64),
+    cache=True, nogil=True)
+def accumulate_points(home, away, home_points, away_points, n_teams):
+    """Returns the total points and the games played for each of n_teams, given
+    per-game team ids and points."""
+    points = np.zeros(n_teams, np.float64)
+    played = np.zeros(n_teams, np.int64)
+    for i in range(home.size):
+        points[home[i]] += home_points[i]
+        points[away[i]] += away_points[i]
+        played[home[i]] += 1
+        played[away[i]] += 1
+    return points, played
+
+
+@nb.njit(nb.float64[:, :](nb.float64[:], nb.float64[:], nb.uint8[:],
+                          nb.uint8[:]),
+         cache=True, nogil=True)
+def offense_defense_points(points_for, points_against, away, home):
+    """Returns an (n, 2) array of the away and home teams' (resp.) expected
+    points, given per-game team ids and each team's points for and against."""
+    out = np.empty((away.size, 2), np.float64)
+    for i in range(away.size):
+        out[i, 0] = points_for[away[i]] - points_against[home[i]]
+        out[i, 1] = points_for[home[i]] - points_against[away[i]]
+    return out
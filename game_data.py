@@ -1,105 +1,187 @@
 """Defines GameData and functions to read it."""
 
+import concurrent.futures
 import functools
 
-from bs4 import BeautifulSoup
+import numpy as np
+import requests
 from multipledispatch import dispatch
+from selectolax.lexbor import LexborHTMLParser
 
 from tools import cache
 from tools import scraper_tools
 from shared_types import *
 
 
+# The play-by-play tables that _load_game_data_online reads.  A page without
+#  them, e.g. a script-only shell or a bot-block page, is not cached.
+PBP_READY_SELECTOR = ('div[aa-region="gametracker|play_by_play_batter"] '
+                      'ul.gametracker-list--play-by-play')
+
+
+# A schedule page has rendered once it shows either the table of games, or the
+#  notice that there are none.  Otherwise an unrendered page would be cached as
+#  a date without games.
+SCHED_READY_SELECTOR = "div#TableBase, div.NoDataAvailable"
+
+
+def _pbp_url(game: Game) -> Url:
+    PBP_URL = "https://www.cbssports.com/nhl/gametracker/playbyplay/NHL_{}_{}@{}"
+    return PBP_URL.format(game.date, game.away, game.home)
+
+
+def _sched_url(date: Date) -> Url:
+    SCHED_URL = "https://www.cbssports.com/nhl/schedule/{}/"
+    return SCHED_URL.format(date)
+
+
+def _games_for_date_key(date: Date) -> str:
+    return f"GAMES_FOR_DATE_{date}"
+
+
 def _load_game_data_online(game: Game) -> Optional[GameData]:
     """Reads a play-by-play page from CBS, given the date and teams,
     keeping only "relevant" plays."""
-    PBP_URL = "https://www.cbssports.com/nhl/gametracker/playbyplay/NHL_{}_{}@{}"
-    url = PBP_URL.format(game.date, game.away, game.home)
+    url = _pbp_url(game)
 
     logging.debug(f"Downloading {url}")
 
-    html = scraper_tools.read_url_to_string(url)
+    # Play-by-play pages are static HTML, as prefetch_urls already relies on.
+    try:
+        html = scraper_tools.read_url_to_string(
+            url, ready_selector=PBP_READY_SELECTOR, needs_browser=False)
+    except (scraper_tools.PageNotReadyError, requests.RequestException):
+        # E.g. a postponed game's 404, or a bot-block page.
+        logging.error(f"No play-by-play found for {game}")
+        return None
 
-    soup = BeautifulSoup(html, features="html.parser")
+    tree = LexborHTMLParser(html)
 
     started_pbp = False  # Don't start reading until first end-of-period
-    result_pbp = list()
     period = 0
 
+    # The play-by-play, one list per GameData column.  CBS lists the most recent
+    #  play first.
+    sides = {game.away: GameData.AWAY, game.home: GameData.HOME}
+    types, teams, periods, secs = list(), list(), list(), list()
+
+    def append_play(hockey_time: HockeyTime, play_type: Play.Type,
+                    team: Optional[Team] = None) -> None:
+        types.append(play_type.value)
+        teams.append(sides.get(team, GameData.NO_TEAM))
+        periods.append(hockey_time.period)
+        secs.append(hockey_time.secs)
+
     # First look for a div called gametracker|play_by_play_batter, which removes
     #  a pesky sidebar.
-    body = soup.find("div", {"aa-region": "gametracker|play_by_play_batter"})
+    body = tree.css_first(
+        'div[aa-region="gametracker|play_by_play_batter"]')
 
     try:
-        tables = body.find_all("ul", {
-            "class": "gametracker-list gametracker-list--play-by-play"})
+        tables = body.css("ul.gametracker-list.gametracker-list--play-by-play")
     except:
         logging.error(f"Tables problem with {game}")
         return None
 
     for table in tables:
-        for row in table.find_all("li"):
-            spans = row.find_all("span")
-            row = [span.text for span in spans]
+        for row in table.css("li"):
+            row = [span.text() for span in row.css("span")]
 
             logging.debug(row)
 
             if row and row[-1].find("End of ") != -1:  # End of game or period
                 period -= 1
                 started_pbp = True
-                result_pbp.append(Play(
-                    game=game,
-                    hockey_time=HockeyTime.from_str(period, "20:00"),
-                    type=Play.Type.end_of_period,
-                ))
+                append_play(HockeyTime.from_str(period, "20:00"),
+                            Play.Type.end_of_period)
 
             if not started_pbp or len(row) != 5:
                 continue
 
-            hockey_time = HockeyTime.from_str(period, row[3])
-
-            this_play_type = None
-            if row[4].find("GOAL") != -1:  # Case sensitive
+            description = row[4]
+            lower_description = description.lower()
+            if "GOAL" in description:  # Case sensitive
                 this_play_type = Play.Type.goal
-            elif row[4].lower().find("faceoff") != -1:
+            elif "faceoff" in lower_description:
                 this_play_type = Play.Type.face_off
-            elif row[4].lower().find("shot") != -1:
+            elif "shot" in lower_description:
                 this_play_type = Play.Type.shot
+            else:
+                continue
 
-            if this_play_type:
-                new_play = Play(
-                    game=game, hockey_time=hockey_time, type=this_play_type,
-                    team=row[2])
-                logging.debug(new_play)
-                result_pbp.append(new_play)
+            if this_play_type is not Play.Type.face_off and row[2] not in sides:
+                # Seems to be a general data error.  Log it.
+                logging.error(f"Error with play {row} in game {game}")
+                # Then just keep going
+            append_play(HockeyTime.from_str(period, row[3]), this_play_type,
+                        team=row[2])
 
     # period is recorded as -1..-3 or -1..-N in the event of overtimes.  Remap -N
-    #  to 1.
-    pbp = list()
-    for play in reversed(result_pbp):
-        play.hockey_time.period += 1 - period
-        pbp.append(play)
-
-    return GameData(game=game, pbp=pbp)
+    #  to 1.  Reversing puts the plays in time-in-game order.
+    return GameData(
+        game=game,
+        types=np.array(types[::-1], dtype=np.uint8),
+        teams=np.array(teams[::-1], dtype=np.uint8),
+        periods=np.array(periods[::-1], dtype=np.int8) + np.int8(1 - period),
+        secs=np.array(secs[::-1], dtype=np.int16),
+    )
 
 
 # NOTE:  Caching logic for the functions below makes it difficult to delete
-#  stale data.  Sub BasicCacher for NoCacher to remove this logic.
+#  stale data.  Sub LMDBCacher for NoCacher to remove this logic.
 
 
-@functools.lru_cache(1500)
+@functools.lru_cache(None)
+@cache.memoize(str, cache.LMDBCacher())
 def load_game_data(game: Game) -> Optional[GameData]:
     """Returns GameData for the game.
 
     If this exists on disk, then will load that.  Otherwise pulls from CBS.
     """
     logging.debug(f"Try load game: {str(game)}")
+    return _load_game_data_online(game)
 
-    @cache.memoize(str(game), cache.BasicCacher())
-    def load_game_data_online():
-        return _load_game_data_online(game)
 
-    return load_game_data_online()
+def prewarm(games: List[Game]) -> None:
+    """Loads all games into load_game_data's in-process cache, in parallel."""
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        list(executor.map(load_game_data, games))
+
+
+@functools.lru_cache(None)
+@cache.memoize(_games_for_date_key, cache.LMDBCacher())
+def _get_games_for_date(date: Date) -> List[Game]:
+    html = scraper_tools.read_url_to_string(
+        _sched_url(date), ready_selector=SCHED_READY_SELECTOR)
+    tree = LexborHTMLParser(html)
+
+    games = list()
+    table = tree.css_first("div#TableBase")
+
+    # If the date has no games, then this table won't exist.
+    if not table:
+        return []
+
+    for tr in table.css("tr.TableBase-bodyTr"):
+        try:
+            away_team, home_team = None, None
+            for tdi, td in enumerate(tr.css("td.TableBase-bodyTd")):
+                if tdi == 0:
+                    away_link = td.css_first("a").attributes["href"]
+                    away_team = away_link.split("teams/")[1].split("/")[0]
+                if tdi == 1:
+                    home_link = td.css_first("a").attributes["href"]
+                    home_team = home_link.split("teams/")[1].split("/")[0]
+                if tdi > 2:
+                    break
+
+            assert (away_team)
+            assert (home_team)
+            games.append(Game(date=date, away=away_team, home=home_team))
+        except:
+            pass
+
+    return games
 
 
 @dispatch(Date)
@@ -108,52 +190,30 @@ def get_games(date: Date) -> List[Game]:
 
     logging.debug(f"Looking games for date {date}")
 
-    @cache.memoize(f"GAMES_FOR_DATE_{date}", cache.BasicCacher())
-    def get_games_for_date_impl():
-        SCHED_URL = "https://www.cbssports.com/nhl/schedule/{}/"
-        html = scraper_tools.read_url_to_string(SCHED_URL.format(date))
-        soup = BeautifulSoup(html, features="html.parser")
-
-        games = list()
-        table = soup.find("div", id="TableBase")
-
-        # If the date has no games, then this table won't exist.
-        if not table:
-            return []
+    return list(_get_games_for_date(date))
 
-        for tr in table.find_all("tr", {"class": "TableBase-bodyTr"}):
-            try:
-                away_team, home_team = None, None
-                for tdi, td in enumerate(
-                    tr.find_all("td", {"class": "TableBase-bodyTd"})):
-                    if tdi == 0:
-                        away_link = td.find("a")["href"]
-                        away_team = away_link.split("teams/")[1].split("/")[0]
-                    if tdi == 1:
-                        home_link = td.find("a")["href"]
-                        home_team = home_link.split("teams/")[1].split("/")[0]
-                    if tdi > 2:
-                        break
 
-                assert (away_team)
-                assert (home_team)
-                games.append(Game(date=date, away=away_team, home=home_team))
-            except:
-                pass
+@functools.lru_cache(None)
+def _get_games_for_season(year: int) -> List[Game]:
+    dates = Season(year).get_all_dates()
+    # Read the schedule pages of any dates not already parsed in parallel, one
+    #  per pooled browser, so that the loop below reads them from disk.
+    cacher = cache.LMDBCacher()
+    scraper_tools.read_urls(
+        [_sched_url(date) for date in dates
+         if not cacher.contains(_games_for_date_key(date))],
+        ready_selector=SCHED_READY_SELECTOR)
 
-        return games
-
-    return get_games_for_date_impl()
+    result = list()
+    for date in dates:
+        result.extend(_get_games_for_date(date))
+    return result
 
 
 @dispatch(Season)
 def get_games(season: Season) -> List[Game]:
     """List of games for a season."""
-    result = list()
-    for date in season.get_all_dates():
-        for game in get_games(date):
-            result.append(game)
-    return result
+    return list(_get_games_for_season(season.year))
 
 
 @dispatch(Date)
@@ -166,15 +226,14 @@ def get_games_data(date: Date) -> Iterable[GameData]:
 @dispatch(Season)
 def get_games_data(season: Season) -> Iterable[GameData]:
     """Read all games in a given season, storing to their respective files."""
-    for game in get_games(season):
+    games = get_games(season)
+    # Download the pages concurrently up front, so that loading each game below
+    #  reads its page from disk.
+    scraper_tools.prefetch_urls((_pbp_url(game) for game in games),
+                                ready_selector=PBP_READY_SELECTOR)
+    for game in games:
         yield load_game_data(game)
 
 
 def make_dataset(season: Season, test_portion: float = 0.2) -> TrainTest:
-    assert (0 < test_portion < 1.0)
-
-    train_portion = 1.0 - test_portion
-
-    games = get_games(season)
-    cutoff = int(len(games) * train_portion)
-    return TrainTest(train=games[:cutoff], test=games[cutoff:])
+    return TrainTest.from_games(get_games(season), test_portion)
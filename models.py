@@ -1,10 +1,13 @@
-from collections import defaultdict
+import functools
+import warnings
 from typing import Callable, Tuple
 
+import attr
 import numpy as np
-import pandas as pd
-import statsmodels.api as sm
+import scipy.linalg
+import scipy.sparse
 
+import fast_stats
 import game_data
 from constants import *
 from shared_types import *
@@ -13,6 +16,30 @@ AwayHomeTarget = Tuple[float, float]
 TargetGetter = Callable[[Game], AwayHomeTarget]
 
 
+def _team_ids(games: List[Game]) -> Tuple[np.ndarray, np.ndarray]:
+    """Index arrays into ALL_TEAMS for the away and home teams (resp.), as
+    uint8."""
+    away_idx = np.fromiter((TEAM_INDEX[game.away] for game in games),
+                           dtype=np.uint8, count=len(games))
+    home_idx = np.fromiter((TEAM_INDEX[game.home] for game in games),
+                           dtype=np.uint8, count=len(games))
+    return away_idx, home_idx
+
+
+def _kernel_ids(idx: np.ndarray) -> np.ndarray:
+    """idx as a writeable uint8 array, as the fast_stats kernels are compiled
+    for.
+
+    The kernels don't check bounds, so this raises IndexError for any id that
+    doesn't index ALL_TEAMS, rather than casting it.
+    """
+    idx = np.asarray(idx)
+    if idx.size and (not np.issubdtype(idx.dtype, np.integer) or
+                     idx.min() < 0 or idx.max() >= N_TEAMS):
+        raise IndexError(f"Team ids must be integers in [0, {N_TEAMS})")
+    return np.require(idx, np.uint8, ["C", "W"])
+
+
 def _scores(game: Game) -> Optional[AwayHomeTarget]:
     """Gets scores for the game.  Default target."""
     data = game_data.load_game_data(game)
@@ -21,48 +48,111 @@ def _scores(game: Game) -> Optional[AwayHomeTarget]:
     return (data.away_score, data.home_score)
 
 
+@attr.s(eq=False)
+class GameStore(object):
+    """Team ids and targets for a list of games, stored column-wise.
+
+    Row i is games[i], which was at position index[i] of the list the store was
+    made from.  Team ids index into teams, which starts with ALL_TEAMS and then
+    lists any other teams that played, so ids below N_TEAMS agree with
+    TEAM_INDEX.
+    """
+    games: List[Game] = attr.ib()
+    index: np.ndarray = attr.ib()
+    teams: Tuple[Team, ...] = attr.ib()
+    away: np.ndarray = attr.ib()  # Index into teams, as uint8
+    home: np.ndarray = attr.ib()  # Index into teams, as uint8
+    targets: np.ndarray = attr.ib()  # (n, 2), away and home (resp.)
+
+    def __len__(self) -> int:
+        return len(self.games)
+
+    @property
+    def listed(self) -> np.ndarray:
+        """Mask of the rows with both teams in ALL_TEAMS."""
+        return (self.away < N_TEAMS) & (self.home < N_TEAMS)
+
+    @classmethod
+    def from_games(cls, games: List[Game],
+                   target_getter: TargetGetter) -> 'GameStore':
+        """Keeps the games that have a target."""
+        team_ids = dict(TEAM_INDEX)
+        index, away, home, targets = list(), list(), list(), list()
+        for i, game in enumerate(games):
+            game_targets = target_getter(game)
+            if not game_targets:
+                # Skip over errors
+                continue
+            index.append(i)
+            away.append(team_ids.setdefault(game.away, len(team_ids)))
+            home.append(team_ids.setdefault(game.home, len(team_ids)))
+            targets.append(game_targets)
+
+        assert (len(team_ids) <= np.iinfo(np.uint8).max + 1)
+        return cls(games=[games[i] for i in index],
+                   index=np.array(index, dtype=np.intp),
+                   teams=tuple(team_ids), away=np.array(away, dtype=np.uint8),
+                   home=np.array(home, dtype=np.uint8),
+                   targets=np.array(targets, dtype=np.float64).reshape(-1, 2))
+
+    def rows(self, mask: np.ndarray) -> 'GameStore':
+        """The rows where mask is True."""
+        return GameStore(
+            games=[game for game, keep in zip(self.games, mask) if keep],
+            index=self.index[mask], teams=self.teams, away=self.away[mask],
+            home=self.home[mask], targets=self.targets[mask])
+
+
+@functools.lru_cache(16)
+def _game_store(games: Tuple[Game, ...],
+                target_getter: TargetGetter) -> GameStore:
+    """Shares one GameStore between all models with the same target."""
+    return GameStore.from_games(list(games), target_getter)
+
+
 class PointsModel(object):
     """A Model class contains information for training and predicting."""
 
     def __init__(self, target_getter: TargetGetter = _scores):
         self.target_getter = target_getter
 
-    def fit_impl(self, train_set: List[Game]) -> None:
+    def fit_impl(self, train_set: GameStore) -> None:
         """Implement this in a child class."""
         raise NotImplementedError
 
+    def _store(self, train_test: TrainTest) -> GameStore:
+        """A GameStore over all of train_test's games, for this model's target."""
+        return _game_store(tuple(train_test.games), self.target_getter)
+
     def fit(self, train_test: TrainTest) -> None:
         """Fits internal variables (by year) from the passed dataset."""
-        self.fit_impl(train_test.train)
+        store = self._store(train_test)
+        self.fit_impl(store.rows(store.index < train_test.cutoff))
 
     def predict(self, game: Game) -> AwayHomeTarget:
         """Returns the expected points for the away and home teams (resp.).
         Implement in the child class."""
         raise NotImplementedError
 
-    def score(self, train_test: TrainTest) -> float:
-        """Computes the MSE on the test set of the train_test passed."""
-        num, den = 0, 0
-        for game in train_test.test:
-            if game.home not in ALL_TEAMS or game.away not in ALL_TEAMS:
-                # We skip Golden Knights so that code can run the same for all years
-                continue
-
-            targets = self.target_getter(game)
-            if not targets:
-                # Skip over errors
-                continue
-            act_away_target, act_home_target = targets
-            pred_away_pts, pred_home_pts = self.predict(game)
+    def predict_batch(self, games: List[Game]) -> np.ndarray:
+        """Returns an (n, 2) array of predict for each game, columns are away and
+        home (resp.).  Child classes may override with a vectorized version."""
+        return np.array([self.predict(game) for game in games],
+                        dtype=np.float64).reshape(-1, 2)
 
-            if pred_home_pts != pred_home_pts or pred_away_pts != pred_away_pts:
-                # Models may return nan for unknowns.
-                continue
+    def _predict_rows(self, rows: GameStore) -> np.ndarray:
+        """predict_batch over the games in rows."""
+        return self.predict_batch(rows.games)
 
-            num += (act_away_target - pred_away_pts) ** 2
-            num += (act_home_target - pred_home_pts) ** 2
-            den += 2
-        return num / den
+    def score(self, train_test: TrainTest) -> float:
+        """Computes the MSE on the test set of the train_test passed."""
+        store = self._store(train_test)
+        # We skip Golden Knights so that code can run the same for all years
+        test = store.rows((store.index >= train_test.cutoff) & store.listed)
+        sq_err = (test.targets - self._predict_rows(test)) ** 2
+        # Models may return nan for unknowns.
+        known = ~np.isnan(sq_err).any(axis=1)
+        return float(sq_err[known].mean())
 
 
 class RandomModel(PointsModel):
@@ -71,7 +161,7 @@ class RandomModel(PointsModel):
     def __init__(self, target_getter: TargetGetter = _scores):
         super().__init__(target_getter)
 
-    def fit_impl(self, train_set: List[Game]) -> None:
+    def fit_impl(self, train_set: GameStore) -> None:
         pass
 
     def predict(self, game: Game) -> AwayHomeTarget:
@@ -82,144 +172,199 @@ class RandomModel(PointsModel):
         return away_score, home_score
 
 
-class InteractionModel(PointsModel):
+class TeamsModel(PointsModel):
+    """A model whose predictions depend only on the away and home teams."""
+
+    def predict_ids(self, away_idx: np.ndarray,
+                    home_idx: np.ndarray) -> np.ndarray:
+        """Like predict_batch, but given index arrays into ALL_TEAMS for the away
+        and home teams (resp.).  Implement in the child class."""
+        raise NotImplementedError
+
+    def predict_batch(self, games: List[Game]) -> np.ndarray:
+        return self.predict_ids(*_team_ids(games))
+
+    def _predict_rows(self, rows: GameStore) -> np.ndarray:
+        # The store already has the team ids.
+        return self.predict_ids(rows.away, rows.home)
+
+
+class InteractionModel(TeamsModel):
     """For this model, the prediction of win margin is average win margin from the
     previous times the two teams met."""
 
     def __init__(self, target_getter: TargetGetter = _scores):
-        # For (x, y), the average points x won when playing against y.
-        self._avg_pts = dict()
+        # For [x, y], the average points x won when playing against y.  NaN if
+        #  the two teams never met.
+        self._avg_pts = None
         super().__init__(target_getter)
 
-    def fit_impl(self, train_set: List[Game]) -> None:
-        _points_won = defaultdict(int)
-        _played = defaultdict(int)
-
-        for game in train_set:
-            targets = self.target_getter(game)
-            if not targets:
-                # Skip over errors
-                continue
-            away_target, home_target = targets
-            _points_won[(game.home, game.away)] += home_target
-            _points_won[(game.away, game.home)] += away_target
-            _played[(game.home, game.away)] += 1
-            _played[(game.away, game.home)] += 1
-
-        for k in _played.keys():
-            self._avg_pts[k] = _points_won[k] / _played[k]
+    def fit_impl(self, train_set: GameStore) -> None:
+        # Widen before multiplying, so the flattened ids don't overflow uint8.
+        away_idx = train_set.away.astype(np.intp)
+        home_idx = train_set.home.astype(np.intp)
+        targets = train_set.targets
+        n_teams = len(train_set.teams)
+        # Flattened [team, opp] ids for each side of each game.
+        home_key = home_idx * n_teams + away_idx
+        away_key = away_idx * n_teams + home_idx
+        size = n_teams * n_teams
+
+        points_won = (
+            np.bincount(home_key, weights=targets[:, 1], minlength=size) +
+            np.bincount(away_key, weights=targets[:, 0], minlength=size))
+        played = (np.bincount(home_key, minlength=size) +
+                  np.bincount(away_key, minlength=size))
+
+        avg_pts = np.full(size, np.nan)
+        np.divide(points_won, played, out=avg_pts, where=played > 0)
+        self._avg_pts = avg_pts.reshape(n_teams, n_teams)[:N_TEAMS, :N_TEAMS]
 
     def predict(self, game: Game) -> AwayHomeTarget:
-        assert (self._avg_pts)  # fit has already run
-        home_pred = self._avg_pts.get((game.home, game.away), np.nan)
-        away_pred = self._avg_pts.get((game.away, game.home), np.nan)
-        return away_pred, home_pred
+        assert (self._avg_pts is not None)  # fit has already run
+        away, home = TEAM_INDEX[game.away], TEAM_INDEX[game.home]
+        return self._avg_pts[away, home], self._avg_pts[home, away]
 
+    def predict_ids(self, away_idx: np.ndarray,
+                    home_idx: np.ndarray) -> np.ndarray:
+        assert (self._avg_pts is not None)  # fit has already run
+        return np.column_stack([self._avg_pts[away_idx, home_idx],
+                                self._avg_pts[home_idx, away_idx]])
 
-class OffenseDefenseModel(PointsModel):
+
+class OffenseDefenseModel(TeamsModel):
     """For this model, we have a variable for both the team and its opponent."""
 
     def __init__(self, target_getter: TargetGetter = _scores):
-        # The number of points expected to score against base team.
-        self._points_for = dict()
+        # The number of points expected to score against base team.  Indexed
+        #  like ALL_TEAMS.
+        self._points_for = None
         # For each team, t, how many points fewer a team is expected to score
         #  playing t than if they had played the base team.
-        self._points_against = dict()
+        self._points_against = None
         super().__init__(target_getter)
 
-    def fit_impl(self, train_set: List[Game]) -> None:
-        df_data = list()
-        for game in train_set:
-            targets = self.target_getter(game)
-            if not targets:
-                # Skip over errors
-                continue
-            away_target, home_target = targets
-            df_data.append(
-                {"team": game.home, "opp": game.away,
-                 "points": home_target})
-            df_data.append(
-                {"team": game.away, "opp": game.home,
-                 "points": away_target})
-
-        points_df = pd.DataFrame(df_data)
-
-        points_x = pd.concat(
-            [pd.get_dummies(points_df["team"], prefix="TEAM"),
-             pd.get_dummies(points_df["opp"], prefix="OPP", drop_first=True)],
-            axis=1)
-
-        model = sm.OLS(points_df["points"], points_x)
-        results = model.fit()
-
-        for team in ALL_TEAMS:
-            self._points_for[team] = results.params.get(f"TEAM_{team}")
-            self._points_against[team] = results.params.get(f"OPP_{team}", 0)
+    def fit_impl(self, train_set: GameStore) -> None:
+        targets = train_set.targets
+        # One row per team per game: the team, its opponent, and its points.
+        team_idx = np.concatenate([train_set.home, train_set.away])
+        opp_idx = np.concatenate([train_set.away, train_set.home])
+        points = np.concatenate([targets[:, 1], targets[:, 0]])
+
+        # Only teams that played get a variable, including teams outside
+        #  ALL_TEAMS.  The alphabetically first of these is the base team, whose
+        #  OPP column is dropped so that the solution is unique.
+        n_teams = len(train_set.teams)
+        seen = np.array(
+            sorted(np.flatnonzero(np.bincount(team_idx, minlength=n_teams)),
+                   key=train_set.teams.__getitem__), dtype=np.intp)
+        n_seen = len(seen)
+        team_col = np.full(n_teams, -1, dtype=np.intp)
+        team_col[seen] = np.arange(n_seen)
+        opp_col = np.full(n_teams, -1, dtype=np.intp)
+        opp_col[seen[1:]] = n_seen + np.arange(n_seen - 1)
+
+        # Least squares of points on a TEAM and an OPP indicator.  Each row of X
+        #  has at most two nonzeros, so X is sparse, and X^T X is small and
+        #  dense.
+        n_rows = len(points)
+        has_opp = opp_col[opp_idx] >= 0
+        x_rows = np.concatenate([np.arange(n_rows), np.flatnonzero(has_opp)])
+        x_cols = np.concatenate([team_col[team_idx], opp_col[opp_idx[has_opp]]])
+        x = scipy.sparse.csr_matrix(
+            (np.ones(len(x_rows)), (x_rows, x_cols)),
+            shape=(n_rows, 2 * n_seen - 1))
+        xtx, xty = (x.T @ x).toarray(), x.T @ points
+        try:
+            with warnings.catch_warnings():
+                # Ill-conditioned only warns, but the solution is just as bad.
+                warnings.simplefilter("error", scipy.linalg.LinAlgWarning)
+                beta = scipy.linalg.solve(xtx, xty, assume_a="pos")
+        except (scipy.linalg.LinAlgError, scipy.linalg.LinAlgWarning):
+            # X is rank deficient, e.g. if the teams split into groups that
+            #  never played each other.  Take the minimum-norm solution, from X
+            #  itself, since X^T X squares its conditioning.
+            beta = scipy.linalg.lstsq(
+                x.toarray(), points,
+                cond=np.finfo(np.float64).eps * max(x.shape))[0]
+
+        points_for = np.full(n_teams, np.nan)
+        points_for[seen] = beta[:n_seen]
+        points_against = np.zeros(n_teams)
+        points_against[seen[1:]] = beta[n_seen:]
+        self._points_for = points_for[:N_TEAMS]
+        self._points_against = points_against[:N_TEAMS]
 
     def predict(self, game: Game) -> AwayHomeTarget:
-        assert (self._points_for)  # fit has already run
-        return (
-            self._points_for[game.away] - self._points_against[game.home],
-            self._points_for[game.home] - self._points_against[game.away])
+        assert (self._points_for is not None)  # fit has already run
+        away, home = TEAM_INDEX[game.away], TEAM_INDEX[game.home]
+        return (self._points_for[away] - self._points_against[home],
+                self._points_for[home] - self._points_against[away])
+
+    def predict_ids(self, away_idx: np.ndarray,
+                    home_idx: np.ndarray) -> np.ndarray:
+        assert (self._points_for is not None)  # fit has already run
+        return fast_stats.offense_defense_points(
+            self._points_for, self._points_against, _kernel_ids(away_idx),
+            _kernel_ids(home_idx))
 
 
-class OffenseOnlyModel(PointsModel):
+class OffenseOnlyModel(TeamsModel):
     """For this model, we have a variable for both the team and its opponent."""
 
     def __init__(self, target_getter: TargetGetter = _scores):
-        # Average points per game for each team.
-        self._avg_pts = dict()
+        # Average points per game for each team.  Indexed like ALL_TEAMS.
+        self._avg_pts = None
         super().__init__(target_getter)
 
-    def fit_impl(self, train_set: List[Game]) -> None:
-        _points_won = defaultdict(int)
-        _played = defaultdict(int)
-
-        for game in train_set:
-            targets = self.target_getter(game)
-            if not targets:
-                # Skip over errors
-                continue
-            away_target, home_target = targets
-            _points_won[game.home] += home_target
-            _points_won[game.away] += away_target
-            _played[game.home] += 1
-            _played[game.away] += 1
+    def fit_impl(self, train_set: GameStore) -> None:
+        _points_won, _played = fast_stats.accumulate_points(
+            train_set.home, train_set.away, train_set.targets[:, 1],
+            train_set.targets[:, 0], len(train_set.teams))
 
-        for k in _played.keys():
-            self._avg_pts[k] = _points_won[k] / _played[k]
+        # Games against teams outside ALL_TEAMS still count toward the average.
+        avg_pts = np.full(len(train_set.teams), np.nan)
+        np.divide(_points_won, _played, out=avg_pts, where=_played > 0)
+        self._avg_pts = avg_pts[:N_TEAMS]
 
     def predict(self, game: Game) -> AwayHomeTarget:
-        assert (self._avg_pts)  # fit has already run
-        return self._avg_pts[game.away], self._avg_pts[game.home]
+        assert (self._avg_pts is not None)  # fit has already run
+        return (self._avg_pts[TEAM_INDEX[game.away]],
+                self._avg_pts[TEAM_INDEX[game.home]])
+
+    def predict_ids(self, away_idx: np.ndarray,
+                    home_idx: np.ndarray) -> np.ndarray:
+        assert (self._avg_pts is not None)  # fit has already run
+        return np.column_stack([self._avg_pts[away_idx],
+                                self._avg_pts[home_idx]])
 
 
-class DefenseOnlyModel(PointsModel):
+class DefenseOnlyModel(TeamsModel):
     """For this model, we have a variable for both the team and its opponent."""
 
     def __init__(self, target_getter: TargetGetter = _scores):
-        # Average points per game for each team.
-        self._avg_pts = dict()
+        # Average points per game for each team.  Indexed like ALL_TEAMS.
+        self._avg_pts = None
         super().__init__(target_getter)
 
-    def fit_impl(self, train_set: List[Game]) -> None:
-        _points_won = defaultdict(int)
-        _played = defaultdict(int)
-
-        for game in train_set:
-            targets = self.target_getter(game)
-            if not targets:
-                # Skip over errors
-                continue
-            away_target, home_target = targets
-            _points_won[game.home] += away_target
-            _points_won[game.away] += home_target
-            _played[game.home] += 1
-            _played[game.away] += 1
+    def fit_impl(self, train_set: GameStore) -> None:
+        # Same as OffenseOnlyModel, but each team is credited with the points
+        #  scored against it.
+        _points_won, _played = fast_stats.accumulate_points(
+            train_set.home, train_set.away, train_set.targets[:, 0],
+            train_set.targets[:, 1], len(train_set.teams))
 
-        for k in _played.keys():
-            self._avg_pts[k] = _points_won[k] / _played[k]
+        avg_pts = np.full(len(train_set.teams), np.nan)
+        np.divide(_points_won, _played, out=avg_pts, where=_played > 0)
+        self._avg_pts = avg_pts[:N_TEAMS]
 
     def predict(self, game: Game) -> AwayHomeTarget:
-        assert (self._avg_pts)  # fit has already run
-        return self._avg_pts[game.home], self._avg_pts[game.away]
+        assert (self._avg_pts is not None)  # fit has already run
+        return (self._avg_pts[TEAM_INDEX[game.home]],
+                self._avg_pts[TEAM_INDEX[game.away]])
+
+    def predict_ids(self, away_idx: np.ndarray,
+                    home_idx: np.ndarray) -> np.ndarray:
+        assert (self._avg_pts is not None)  # fit has already run
+        return np.column_stack([self._avg_pts[home_idx],
+                                self._avg_pts[away_idx]])
@@ -3,18 +3,34 @@
 Unlike other files, we will import as "from shared_types import *".
 """
 
-import datetime
 import enum
+import functools
 import logging
-from typing import Dict, Iterable, List, Optional, Set
+from typing import Iterable, List, Optional, Tuple
 
 import attr
+import numpy as np
+
+import fast_stats
 
 Date = int  # YYYYMMDD
 Team = str
 Url = str
 
 
+@functools.lru_cache(8192)
+def _clock_secs(clock_time: str) -> int:
+    """Total seconds in clock_time, which is either MM:SS or SS.x."""
+    if ":" in clock_time:
+        # Format MM:SS
+        minu, sec = clock_time.split(":")
+    else:
+        # Format SS.x
+        minu = 0
+        sec, _ = clock_time.split(".")
+    return int(minu) * 60 + int(sec)
+
+
 @attr.s
 class HockeyTime(object):
     period: int = attr.ib()
@@ -23,16 +39,8 @@ class HockeyTime(object):
     @classmethod
     def from_str(cls, period: int, clock_time: str) -> 'HockeyTime':
         """From clock_time (MM:SS) return totals seconds since start of period."""
-        try:
-            # Format MM:SS
-            minu, sec = clock_time.split(":")
-        except:
-            # Format SS.x
-            minu = 0
-            sec, _ = clock_time.split(".")
-        minu = int(minu)
-        sec = int(sec)
-        return HockeyTime(period, minu * 60 + sec)
+        # The same few thousand clock strings repeat across every game.
+        return HockeyTime(period, _clock_secs(clock_time))
 
 
 @attr.s(frozen=True)
@@ -46,6 +54,18 @@ class Game(object):
         return f"{self.date}-{self.away}-{self.home}"
 
 
+@functools.lru_cache(None)
+def _season_dates(year: int) -> Tuple[Date, ...]:
+    """October 1 of year through April 30 of the next year, as YYYYMMDD."""
+    days = np.arange(np.datetime64(f"{year}-10-01"),
+                     np.datetime64(f"{year + 1}-05-01"))
+    months = days.astype("datetime64[M]")
+    ymd = ((months.astype("datetime64[Y]").astype(np.int64) + 1970) * 10000 +
+           (months.astype(np.int64) % 12 + 1) * 100 +
+           (days - months).astype(np.int64) + 1)
+    return tuple(ymd.tolist())
+
+
 class Season(object):
     """Just stores an int representing a year.  """
 
@@ -58,13 +78,8 @@ class Season(object):
         May return additional dates, but does not return dates from other hockey
         seasons.
         """
-        # Loops through October to Apr of next year.
-        cursor = datetime.date(self.year, 10, 1)
-        end_gate = datetime.date(self.year + 1, 4, 30)
-
-        while cursor <= end_gate:
-            yield cursor.year * 10000 + cursor.month * 100 + cursor.day
-            cursor += datetime.timedelta(days=1)
+        # October to Apr of next year.
+        return _season_dates(self.year)
 
 
 @attr.s
@@ -85,12 +100,27 @@ class Play(object):
     team: Optional[Team] = attr.ib(default=None)
 
 
+assert (fast_stats.GOAL == Play.Type.goal.value)
+assert (fast_stats.SHOT == Play.Type.shot.value)
+
+
 class GameData(object):
-    """Includes a play-by-play, and some lazily calculated meta-stats."""
+    """Includes a play-by-play, and some lazily calculated meta-stats.
+
+    The play-by-play is stored column-wise, with one array per Play field, all
+    sorted by time-in-game.
+    """
 
-    def __init__(self, game: Game, pbp: List[Play]):
+    # Values in the teams column.
+    AWAY, HOME, NO_TEAM = fast_stats.AWAY, fast_stats.HOME, fast_stats.NO_TEAM
+
+    def __init__(self, game: Game, types: np.ndarray, teams: np.ndarray,
+                 periods: np.ndarray, secs: np.ndarray):
         self.game = game
-        self.pbp = pbp  # Play-by-play sorted by time-in-game
+        self.types = types  # Play.Type values, as uint8
+        self.teams = teams  # AWAY, HOME, or NO_TEAM, as uint8
+        self.periods = periods  # int8
+        self.secs = secs  # Seconds since the start of the period, as int16
 
         # Derived values
         self._away_att, self._home_att = None, None
@@ -100,33 +130,23 @@ class GameData(object):
         # Compute these values eagerly.  If you remove these lines, the derived
         #  values will get computed lazily.  But then these won't get saved to the
         #  file, so this work will get repeated with each new run.
-        self._compute_atts()
-        self._compute_scores()
-
-    def _count_plays_by_team(self, types: Set[Play.Type]) -> Dict[Team, int]:
-        result = {self.game.away: 0, self.game.home: 0}
-        for play in self.pbp:
-            if play.type in types:
-                try:
-                    result[play.team] += 1
-                except:
-                    # Seems to be a general data error.  Log it.
-                    logging.error(f"Error with play {play} in game {self.game}")
-                    # Then just keep going
-        return result
-
-    def _compute_atts(self):
-        """Sets away_att and home_att."""
-        atts = self._count_plays_by_team({Play.Type.shot, Play.Type.goal})
-        self._away_att, self._home_att = atts[self.game.away], atts[
-            self.game.home]
-
-    def _compute_scores(self):
-        """Sets home_score, away_score, winner, and tie."""
-        scores = self._count_plays_by_team({Play.Type.goal})
-
-        self._away_score, self._home_score = scores[self.game.away], scores[
-            self.game.home]
+        self._compute_stats()
+
+    @property
+    def pbp(self) -> List[Play]:
+        """The play-by-play as Play objects."""
+        team_names = (self.game.away, self.game.home, None)
+        return [
+            Play(game=self.game,
+                 hockey_time=HockeyTime(int(period), int(secs)),
+                 type=Play.Type(int(type_)), team=team_names[team])
+            for type_, team, period, secs in
+            zip(self.types, self.teams, self.periods, self.secs)]
+
+    def _compute_stats(self):
+        """Sets away_att, home_att, away_score, home_score, winner, and tie."""
+        (self._away_att, self._home_att, self._away_score,
+         self._home_score) = fast_stats.compute_stats(self.types, self.teams)
 
         if self._away_score < self._home_score:
             self._winner = self.game.home
@@ -138,43 +158,56 @@ class GameData(object):
     @property
     def away_att(self):
         if self._away_att is None:
-            self._compute_atts()
+            self._compute_stats()
 
         return self._away_att
 
     @property
     def home_att(self):
         if self._home_att is None:
-            self._compute_atts()
+            self._compute_stats()
 
         return self._home_att
 
     @property
     def away_score(self):
         if self._away_score is None:
-            self._compute_scores()
+            self._compute_stats()
 
         return self._away_score
 
     @property
     def home_score(self):
         if self._home_score is None:
-            self._compute_scores()
+            self._compute_stats()
 
         return self._home_score
 
     @property
     def winner(self):
         if self._winner is None and not self._tie:
-            self._compute_scores()
+            self._compute_stats()
 
         return self._winner  # May be None still.
 
 
 @attr.s
 class TrainTest(object):
-    train: List[Game] = attr.ib()
-    test: List[Game] = attr.ib()
+    """Splits games at cutoff, with the earlier games the train set.
+
+    Only the list of games is stored; the train and test sets are sliced from it
+    on access, and no game data is loaded until someone asks for it.
+    """
+    games: List[Game] = attr.ib()
+    cutoff: int = attr.ib()
+
+    @property
+    def train(self) -> List[Game]:
+        return self.games[:self.cutoff]
+
+    @property
+    def test(self) -> List[Game]:
+        return self.games[self.cutoff:]
 
     def __str__(self) -> str:
         CONCAT_LEN = 100
@@ -190,11 +223,11 @@ class TrainTest(object):
         result.append(test_string[:CONCAT_LEN] + test_ell)
         return "\n".join(result)
 
-    @staticmethod
+    @classmethod
     def from_games(cls, games: List[Game],
                    test_portion: float = 0.2) -> 'TrainTest':
         """Make the last test_portion of games the test set - not random."""
         assert (0 < test_portion < 1.0)
         train_portion = 1.0 - test_portion
         cutoff = int(len(games) * train_portion)
-        return TrainTest(train=games[:cutoff], test=games[cutoff:])
+        return cls(games=games, cutoff=cutoff)
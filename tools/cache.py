@@ -1,9 +1,17 @@
+import functools
+import mmap
 import os
 import pickle
-from typing import Any, Optional
+from typing import Any, Callable, Optional
+
+import lmdb
 
 from constants import *
 
+# Plenty of room for a few seasons of play-by-play.  LMDB only uses disk for
+#  what is actually written.
+LMDB_MAP_SIZE = 2 ** 32
+
 
 def _transform_key(key: str) -> str:
     """Make it safe to save"""
@@ -17,6 +25,10 @@ class Cacher(object):
         """Returns data if found, otherwise None."""
         raise NotImplementedError
 
+    def contains(self, key: str) -> bool:
+        """True if try_to_read would find data for key."""
+        return self.try_to_read(key) is not None
+
     def write(self, key: str, value: Any) -> None:
         """Write value by key locally."""
         raise NotImplementedError
@@ -38,9 +50,26 @@ class BasicCacher(Cacher):
     def try_to_read(self, key: str) -> Optional[Any]:
         """Try to read locally."""
         tkey = _transform_key(key)
-        if os.path.exists(tkey):
-            with open(tkey, "rb") as f:
-                return pickle.load(f)
+        try:
+            fd = os.open(tkey, os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            size = os.fstat(fd).st_size
+            if size == 0:
+                return None
+            # Unpickle from one mapped buffer, rather than many small reads.
+            with mmap.mmap(fd, size, access=mmap.ACCESS_READ) as mm:
+                return pickle.loads(mm)
+        finally:
+            os.close(fd)
+
+    def contains(self, key: str) -> bool:
+        """Checks the file, without reading it."""
+        try:
+            return os.stat(_transform_key(key)).st_size > 0
+        except FileNotFoundError:
+            return False
 
     def write(self, key: str, value: Any) -> None:
         """Write if file doesn't already exist, and set ttl."""
@@ -49,9 +78,41 @@ class BasicCacher(Cacher):
             pickle.dump(value, f)
 
 
-def memoize(key: str, cacher: Cacher):
+@functools.lru_cache(None)
+def _lmdb_env() -> lmdb.Environment:
+    """A single environment, shared for the lifetime of the process."""
+    return lmdb.open(DATA_DIR, map_size=LMDB_MAP_SIZE, subdir=True,
+                     writemap=True)
+
+
+class LMDBCacher(Cacher):
+    """Stores every key in a single LMDB file under DATA_DIR.
+
+    Avoids the per-key stat and open that BasicCacher pays on each read.
+    """
+
+    def try_to_read(self, key: str) -> Optional[Any]:
+        """Try to read locally."""
+        with _lmdb_env().begin() as txn:
+            buf = txn.get(key.encode())
+            if buf is not None:
+                return pickle.loads(buf)
+
+    def write(self, key: str, value: Any) -> None:
+        """Write, overwriting any existing value."""
+        buf = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with _lmdb_env().begin(write=True) as txn:
+            txn.put(key.encode(), buf)
+
+
+def memoize(key_fn: Callable[..., str], cacher: Cacher):
+    """Caches the decorated function with cacher, keyed on key_fn applied to the
+    arguments of each call."""
+
     def real_memoize(func):
+        @functools.wraps(func)
         def func_with_memo(*args, **kwargs):
+            key = key_fn(*args, **kwargs)
             cached_value = cacher.try_to_read(key)
             if cached_value is not None:
                 return cached_value
@@ -1,13 +1,45 @@
+import asyncio
+import atexit
+import concurrent.futures
+import contextlib
+import functools
 import logging
-import time
+import os
+import queue
+from typing import Iterable, Iterator, List, Optional
 
+import aiohttp
+import requests
 import retrying
+from requests.adapters import HTTPAdapter
+from selectolax.lexbor import LexborHTMLParser
 from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+from urllib3.util.retry import Retry
 
 from tools import cache
 from constants import *
 
-DRIVER_DELAY_SEC = 3
+# Longest to wait for a page to render.
+DRIVER_TIMEOUT_SEC = 10
+# Longest to wait on a plain HTTP request.
+REQUEST_TIMEOUT_SEC = 10
+# Number of browsers kept open for reading URLs in parallel.
+WEB_DRIVER_POOL_SIZE = 4
+# Max number of requests in flight when prefetching.
+PREFETCH_CONCURRENCY = 16
+# Connections kept open by the session.  Matches ThreadPoolExecutor's default
+#  number of threads, which game_data.prewarm reads with.
+SESSION_POOL_SIZE = min(32, (os.cpu_count() or 1) + 4)
+# Sent on plain HTTP requests, so that they look like the browser's.
+USER_AGENT = ("Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 "
+              "Firefox/128.0")
+
+
+class PageNotReadyError(Exception):
+    """A page was read without its ready_selector element."""
 
 
 class WebDriver(object):
@@ -37,35 +69,185 @@ class WebDriver(object):
             logging.debug("Finished initializing driver.")
         return self._driver
 
-    def __exit__(self, type, value, tb):
-        """Clean-up on exit."""
+    def close(self):
+        """Quit the browser, if it was ever started."""
         if self._driver:
             self._driver.quit()
         self._driver = None
 
+    def __exit__(self, type, value, tb):
+        """Clean-up on exit."""
+        self.close()
+
+
+class WebDriverPool(object):
+    """A fixed set of long-lived WebDrivers, lent out to one thread at a time.
+
+    Each browser is only started the first time it is used.
+    """
 
-def read_url_to_string(url: str) -> str:
+    def __init__(self, size: int):
+        self._web_drivers = [WebDriver() for _ in range(size)]
+        self._available = queue.Queue()
+        for web_driver in self._web_drivers:
+            self._available.put(web_driver)
+
+    @contextlib.contextmanager
+    def borrow(self) -> Iterator[WebDriver]:
+        """Blocks until a WebDriver is free, and returns it when done.
+
+        If the borrower raises, the browser is closed, so that a crashed or hung
+        browser is restarted on its next use.
+        """
+        web_driver = self._available.get()
+        try:
+            yield web_driver
+        except Exception:
+            web_driver.close()
+            raise
+        finally:
+            self._available.put(web_driver)
+
+    def close(self):
+        """Quit every browser that was started."""
+        for web_driver in self._web_drivers:
+            web_driver.close()
+
+
+# Browsers are shared by every read, so that startup, connections, and the
+#  site's session are reused across pages.
+_WEB_DRIVER_POOL = WebDriverPool(WEB_DRIVER_POOL_SIZE)
+atexit.register(_WEB_DRIVER_POOL.close)
+
+
+# For pages that don't need a browser.  Keeps connections alive between requests.
+_SESSION = requests.Session()
+_SESSION.headers["User-Agent"] = USER_AGENT
+_SESSION.mount("https://", HTTPAdapter(
+    pool_maxsize=SESSION_POOL_SIZE,
+    max_retries=Retry(total=3, backoff_factor=0.2,
+                      status_forcelist=(500, 502, 503, 504))))
+
+
+def _check_ready(url: str, page_text: str, ready_selector: Optional[str]):
+    """Raises PageNotReadyError if ready_selector is given and not in the page.
+
+    E.g. a script-only shell, or a bot-block page, is caught here instead of
+    being cached.
+    """
+    if ready_selector and not LexborHTMLParser(page_text).css_first(
+            ready_selector):
+        raise PageNotReadyError(f"No {ready_selector} in {url}")
+
+
+def _read_url_with_session(url: str, ready_selector: Optional[str]) -> str:
+    response = _SESSION.get(url, timeout=REQUEST_TIMEOUT_SEC)
+    response.raise_for_status()
+    _check_ready(url, response.text, ready_selector)
+    return response.text
+
+
+# Each attempt borrows again, so a retry after a browser failure gets a
+#  restarted browser.
+@retrying.retry(wait_random_min=200, wait_random_max=400,
+                stop_max_attempt_number=3)
+def _read_url_with_driver(url: str, ready_selector: str) -> str:
+    with _WEB_DRIVER_POOL.borrow() as web_driver:
+        driver = web_driver.driver()
+        driver.get(url)
+        WebDriverWait(driver, DRIVER_TIMEOUT_SEC).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, ready_selector)))
+        return driver.page_source
+
+
+@cache.memoize(lambda url, ready_selector, needs_browser: url,
+               cache.BasicCacher())
+def _read_url(url: str, ready_selector: Optional[str],
+              needs_browser: bool) -> str:
+    if not needs_browser:
+        return _read_url_with_session(url, ready_selector)
+    return _read_url_with_driver(url, ready_selector)
+
+
+def read_url_to_string(url: str, ready_selector: Optional[str] = None,
+                       needs_browser: bool = True) -> str:
     """ Read from a url and print to a string, after fully buffering.
 
     If errors after three tries, then will return an empty string.
 
     Args:
         url: The URL to read.
+        ready_selector: CSS selector for an element whose presence means the
+            page has rendered.  Required with the browser, since the page is
+            cached as soon as it is read.  Without the browser, if given, pages
+            missing it raise PageNotReadyError instead of being cached.
+        needs_browser: If False, the page is static HTML, and is read with a
+            plain HTTP request instead of a browser.
 
     Returns:
          The body of the resulting HTML in a flat string.
     """
-
-    @cache.memoize(url, cache.BasicCacher())
-    @retrying.retry(wait_random_min=200, wait_random_max=400,
-                    stop_max_attempt_number=3)
-    def read_url_to_string_helper(help_url, web_driver):
-        web_driver.driver().get(help_url)
-        time.sleep(DRIVER_DELAY_SEC)
-        return web_driver.driver().page_source
-
+    assert (ready_selector or not needs_browser)
     logging.debug(f"Reading URL: {url}")
-    with WebDriver() as driver:
-        page_text = read_url_to_string_helper(url, driver)
+    page_text = _read_url(url, ready_selector, needs_browser)
     logging.debug("Finished pulling URL.")
     return page_text
+
+
+def read_urls(urls: List[str], ready_selector: Optional[str] = None,
+              needs_browser: bool = True) -> List[str]:
+    """Like read_url_to_string, for many urls at once, reading up to
+    WEB_DRIVER_POOL_SIZE of them in parallel.
+
+    Returns the pages in the same order as urls.
+    """
+    read = functools.partial(read_url_to_string, ready_selector=ready_selector,
+                             needs_browser=needs_browser)
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=WEB_DRIVER_POOL_SIZE) as executor:
+        return list(executor.map(read, urls))
+
+
+async def _fetch_one(url: str, ready_selector: Optional[str],
+                     semaphore: asyncio.Semaphore,
+                     session: aiohttp.ClientSession,
+                     cacher: cache.Cacher) -> None:
+    async with semaphore:
+        try:
+            async with session.get(url) as response:
+                response.raise_for_status()
+                page_text = await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError, UnicodeDecodeError):
+            # Leave this one for read_url_to_string.
+            logging.error(f"Failed to prefetch {url}")
+            return
+    try:
+        _check_ready(url, page_text, ready_selector)
+    except PageNotReadyError:
+        logging.error(f"Prefetched {url} is missing {ready_selector}")
+        return
+    cacher.write(url, page_text)
+
+
+async def _fetch_all(urls: Iterable[str],
+                     ready_selector: Optional[str]) -> None:
+    cacher = cache.BasicCacher()
+    # Only stat the cache here, so that nothing is unpickled on the event loop.
+    urls = [url for url in urls if not cacher.contains(url)]
+    semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+    async with aiohttp.ClientSession(
+            headers={"User-Agent": USER_AGENT}) as session:
+        await asyncio.gather(
+            *[_fetch_one(url, ready_selector, semaphore, session, cacher)
+              for url in urls])
+
+
+def prefetch_urls(urls: Iterable[str],
+                  ready_selector: Optional[str] = None) -> None:
+    """Concurrently download any of urls not already cached, so that later calls
+    to read_url_to_string on them read from disk.
+
+    Pages are fetched over plain HTTP, without the browser.  Failures, and pages
+    missing ready_selector if given, are logged and skipped.
+    """
+    asyncio.run(_fetch_all(urls, ready_selector))